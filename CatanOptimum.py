@@ -1,8 +1,27 @@
+import argparse
+import ast
+import bisect
+import collections
+import concurrent.futures
+import csv
+import heapq
+import http.server
+import itertools
+import json
+import math
+import mmap
+import multiprocessing
+import operator
+import os
+import queue
 import random
-from collections import namedtuple
+import struct
+import sys
+import threading
+import time
+import urllib.request
 import tkinter as tk
 from tkinter import ttk
-import itertools
 
 # TODO: Pair-wise comparisons
 # TODO: 2nd settlement selector
@@ -12,41 +31,101 @@ class Board:
     Object representing a Settlers of Catan Board.
     """
 
+    metrics = ['dot_sum', 'hit_frequency', 'flow_rate_no_trades',
+               'flow_rate', 'fill_rate']
+
     @classmethod
-    def random_board(cls, seed="PyTN2018"):
+    def from_description(cls, tiles, ports=None, layout=None):
+        """
+        Return a Board from plain data, as read from JSON or CSV.
+
+        Deserts may be given as None, '' or 'desert', with any number.
+        Every other tile needs a number from 2 to 6 or 8 to 12.
+
+        :param tiles: list of (resource, number) pairs.
+        :param ports: optional list of (resource, (node, node)) pairs.
+        :param layout: Layout or name of a layout, defaults to the base board.
+        :return:
+        """
+        if isinstance(layout, str):
+            layout = Layout.named(layout)
+        if layout is None:
+            layout = Layout.base()
+
+        if len(tiles) != len(layout.tiles):
+            raise ValueError('Expected {} tiles, got {}.'.format(
+                len(layout.tiles), len(tiles)))
+
+        description = []
+        for resource, number in tiles:
+            if resource in (None, '', 'desert'):
+                description.append((None, None))
+            elif resource not in Tile.resources:
+                raise ValueError('Unknown resource {!r}.'.format(resource))
+            else:
+                try:
+                    value = int(number)
+                except (TypeError, ValueError):
+                    value = None
+                if value not in Tile.numbers:
+                    raise ValueError('Bad number {!r} for {}.'.format(
+                        number, resource))
+                description.append((resource, value))
+
+        if ports:
+            ports = [(resource, tuple(nodes)) for resource, nodes in ports]
+            for resource, nodes in ports:
+                if resource not in Port.kinds:
+                    raise ValueError('Unknown port {!r}.'.format(resource))
+                if (len(nodes) != 2 or
+                        not all(isinstance(node, int) and
+                                0 <= node < len(layout.nodes)
+                                for node in nodes)):
+                    raise ValueError('Bad nodes {!r} for port {!r}.'.format(
+                        list(nodes), resource))
+
+        board = Board(description, layout)
+
+        if ports:
+            board._setup_ports(ports)
+
+        return board
+
+    @classmethod
+    def random_board(cls, seed="PyTN2018", layout=None):
         """
         Return a random Board object.
 
         :param seed: Seed of the randomizer.
+        :param layout: Layout of the board, defaults to the base board.
         :return:
         """
+        if layout is None:
+            layout = Layout.base()
+
         random.seed(a=seed)
 
-        res = (['lumber'] * 4) + \
-              (['grain'] * 4) + \
-              (['brick'] * 3) + \
-              (['ore'] * 3) + \
-              (['wool'] * 4)
+        res = list(layout.resources)
 
         random.shuffle(res)
 
-        nums = [2, 3, 3, 4, 4, 5, 5, 6, 6, 8, 8, 9, 9, 10, 10, 11, 11, 12]
+        nums = list(layout.numbers)
 
         random.shuffle(nums)
 
         description = list(zip(res, nums))
-        description.append((None, None))
+        description.extend([(None, None)] * layout.deserts)
 
         random.shuffle(description)
 
-        return Board(description)
+        return Board(description, layout)
 
-    def __init__(self, tiles):
+    def __init__(self, tiles, layout=None):
         """
         Initialize the board based on the description. The description is a
         list of tuples, detailing the board. Tuples are (resource, number)
-        ordered 0 to 18. Starting in the top left-most tile as 0, then going
-        down each row sequentially.
+        ordered 0 to 18 on the base board. Starting in the top left-most tile
+        as 0, then going down each row sequentially.
 
              00 01 02
            03 04 05 06
@@ -55,24 +134,28 @@ class Board:
              16 17 18
 
         :param tiles: a list of tuples as (resource, number) of tiles.
+        :param layout: Layout of the board, defaults to the base board.
         """
-        self.tiles = [Tile() for _ in range(19)]
+        self.layout = layout if layout is not None else Layout.base()
+
+        self.tiles = [Tile() for _ in self.layout.tiles]
 
         for i, (resource, number) in enumerate(tiles):
             self.tiles[i].resource = resource
             self.tiles[i].number = number
 
-        self.nodes = [Node(i) for i in range(54)]
-        self.ports = [Port(i) for i in range(9)]
+        self.nodes = [Node(i) for i in range(len(self.layout.nodes))]
+        self.ports = []
 
         self._setup_nodes()
         self._setup_ports()
+        self._setup_rolls()
 
     def _setup_nodes(self):
         """
-        Setup the nodes of the board.
+        Setup the nodes of the board from the layout.
         Nodes are laid out starting in the top left-most at 0 and  then
-        increasing sequentially to the right and down.
+        increasing sequentially to the right and down. For the base board:
 
                00  01  02
               / \ / \ / \
@@ -99,78 +182,13 @@ class Board:
           51  52  53
         :return:
         """
-
-        # Hard Coded connections based on indices.
-        # ([Tiles], [Neighbors])
-        Connection = namedtuple('Connection', ['tiles', 'neighbors'])
-        connections = {
-            0: Connection([0], [3, 4]),
-            1: Connection([1], [4, 5]),
-            2: Connection([2], [5, 6]),
-            3: Connection([0], [0, 7]),
-            4: Connection([0, 1], [0, 1, 8]),
-            5: Connection([1, 2], [1, 2, 9]),
-            6: Connection([2], [2, 10]),
-            7: Connection([0, 3], [3, 11, 12]),
-            8: Connection([0, 1, 4], [4, 12, 13]),
-            9: Connection([1, 2, 5], [5, 13, 14]),
-            10: Connection([2, 6], [6, 14, 15]),
-            11: Connection([3], [7, 16]),
-            12: Connection([0, 3, 4], [7, 8, 17]),
-            13: Connection([1, 4, 5], [8, 9, 18]),
-            14: Connection([2, 5, 6], [9, 10, 19]),
-            15: Connection([6], [10, 20]),
-            16: Connection([3, 7], [11, 21, 22]),
-            17: Connection([3, 4, 8], [12, 22, 23]),
-            18: Connection([4, 5, 9], [13, 23, 24]),
-            19: Connection([5, 6, 10], [14, 24, 25]),
-            20: Connection([6, 11], [15, 25, 26]),
-            21: Connection([7], [16, 27]),
-            22: Connection([3, 7, 8], [16, 17, 28]),
-            23: Connection([4, 8, 9], [17, 18, 29]),
-            24: Connection([5, 9, 10], [18, 19, 30]),
-            25: Connection([6, 10, 11], [19, 20, 31]),
-            26: Connection([11], [20, 32]),
-            27: Connection([7], [21, 33]),
-            28: Connection([7, 8, 12], [22, 33, 34]),
-            29: Connection([8, 9, 13], [23, 34, 35]),
-            30: Connection([9, 10, 14], [24, 35, 36]),
-            31: Connection([10, 11, 15], [25, 36, 37]),
-            32: Connection([11], [26, 37]),
-            33: Connection([7, 12], [27, 28, 38]),
-            34: Connection([8, 12, 13], [28, 29, 39]),
-            35: Connection([9, 13, 14], [29, 30, 40]),
-            36: Connection([10, 14, 15], [30, 31, 41]),
-            37: Connection([11, 15], [31, 32, 42]),
-            38: Connection([12], [33, 43]),
-            39: Connection([12, 13, 16], [34, 43, 44]),
-            40: Connection([13, 14, 17], [35, 44, 45]),
-            41: Connection([14, 15, 18], [36, 45, 46]),
-            42: Connection([15], [37, 46]),
-            43: Connection([12, 16], [38, 39, 47]),
-            44: Connection([13, 16, 17], [39, 40, 48]),
-            45: Connection([14, 17, 18], [40, 41, 49]),
-            46: Connection([15, 18], [41, 42, 50]),
-            47: Connection([16], [43, 51]),
-            48: Connection([16, 17], [44, 51, 52]),
-            49: Connection([17, 18], [45, 52, 53]),
-            50: Connection([18], [46, 53]),
-            51: Connection([16], [47, 48]),
-            52: Connection([17], [48, 49]),
-            53: Connection([18], [49, 50])
-        }
-
         # Setup nodes w/ tiles.
-        for i in range(54):
-            self.nodes[i].tiles = [self.tiles[j]
-                                   for j
-                                   in connections[i].tiles]
+        for i, tiles in enumerate(self.layout.node_tiles):
+            self.nodes[i].tiles = [self.tiles[j] for j in tiles]
 
         # Connect nodes to each other
-        for i in range(54):
-            self.nodes[i].neighbors = [self.nodes[j]
-                                       for j
-                                       in connections[i].neighbors]
+        for i, neighbors in enumerate(self.layout.node_neighbors):
+            self.nodes[i].neighbors = [self.nodes[j] for j in neighbors]
 
     def _setup_ports(self, ports=None):
         """
@@ -184,17 +202,9 @@ class Board:
             node.ports.clear()
 
         if not ports:
-            ports = [
-                ('all', (0, 3)),
-                ('grain', (1, 5)),
-                ('ore', (10, 15)),
-                ('all', (26, 32)),
-                ('wool', (42, 46)),
-                ('all', (49, 52)),
-                ('all', (47, 51)),
-                ('brick', (33, 38)),
-                ('lumber', (11, 16))
-            ]
+            ports = self.layout.ports
+
+        self.ports = [Port(i) for i in range(len(ports))]
 
         for i, (resource, nodes) in enumerate(ports):
             self.ports[i].resource = resource
@@ -203,65 +213,241 @@ class Board:
             for node in nodes:
                 self.nodes[node].ports.append(self.ports[i])
 
-    def get_pairwise_dot_sum(self):
-        dot_pairs = []
-        for a, b in itertools.combinations(self.nodes, 2):
-            if a in b.neighbors or b in a.neighbors:
-                continue
-            dot_pairs.append(((a.index, b.index), a.get_dot_sum() + b.get_dot_sum()))
+        self.node_ports = [node.get_port_mask() for node in self.nodes]
 
-        return dot_pairs
+    def swap_tiles(self, a, b, numbers_only=False):
+        """
+        Swap two tiles, or just their numbers, in place.
 
-    def get_pairwise_hit_frequency(self):
-        freq_pairs = []
-        for a, b in itertools.combinations(self.nodes, 2):
-            if a in b.neighbors or b in a.neighbors:
-                continue
-            nums_a = set(tile.number for tile in a.tiles)
-            nums_b = set(tile.number for tile in b.tiles)
+        :param a: index of a tile.
+        :param b: index of another tile.
+        :param numbers_only: keep the resources where they are.
+        :return: set of indices of the nodes touching the two tiles.
+        """
+        tile_a, tile_b = self.tiles[a], self.tiles[b]
+        old_tiles = [(tile_a.resource, tile_a.number),
+                     (tile_b.resource, tile_b.number)]
 
-            nums = nums_a | nums_b
+        tile_a.number, tile_b.number = tile_b.number, tile_a.number
+        if not numbers_only:
+            tile_a.resource, tile_b.resource = (tile_b.resource,
+                                                tile_a.resource)
 
-            freq_pairs.append((
-                (a.index, b.index),
-                sum((Tile.number_to_dots(num) / 36) for num in nums)))
+        return self._update_tiles([a, b], old_tiles)
 
-        return freq_pairs
+    def _setup_rolls(self):
+        """
+        Setup the roll lookups of the board.
+
+        roll_tiles maps each roll of 2d6 to the tiles it pays, and
+        production[roll - 2][node * 5 + resource] is how many of each
+        resource (in the order of Tile.resources) a settlement on the node
+        receives for the roll, an 11 x nodes x 5 tensor kept as one flat
+        list per roll. The per-node dots, numbers and production odds the
+        metrics read are sums over the tensor, kept exact in integer dots
+        and moved by the same deltas as the tensor.
+        A tile without a resource pays nothing, so it adds no dots or numbers.
+        :return:
+        """
+        empty = [0] * len(Tile.resources)
 
-    def get_pairwise_flow_rate_no_trades(self):
-        flow_pairs = []
-        for a, b in itertools.combinations(self.nodes, 2):
-            if a in b.neighbors or b in a.neighbors:
-                continue
-            flow_pairs.append((
-            (a.index, b.index),
-            (a.get_flow_rate_no_trades() + b.get_flow_rate_no_trades())))
+        self.roll_tiles = {roll: [] for roll in range(2, 13)}
+        self.production = [empty * len(self.nodes) for _ in range(2, 13)]
 
-        return flow_pairs
+        self.node_dots = [0] * len(self.nodes)
+        self.node_masks = [0] * len(self.nodes)
+        self.node_production = [empty[:] for _ in self.nodes]
+        self._node_yields = [empty[:] for _ in self.nodes]
 
-    def get_pairwise_flow_rate(self):
-        flow_pairs = []
+        for i, tile in enumerate(self.tiles):
+            self._pay_tile(i, tile.resource, tile.number, 1)
 
-        for a, b in itertools.combinations(self.nodes, 2):
-            if a in b.neighbors or b in a.neighbors:
-                continue
-            a_flow = a.get_flow_rate()
-            b_flow = b.get_flow_rate()
+    def _pay_tile(self, index, resource, number, count):
+        """
+        Add (count 1) or remove (count -1) a tile from the roll lookups.
 
-            flow = {
-                resource: a_flow.get(resource, 0) + b_flow.get(resource, 0)
-                for resource
-                in set(a_flow) | set(b_flow)
-            }
+        :return:
+        """
+        if not resource or number not in self.roll_tiles:
+            return
 
-            flow_pairs.append(((a.index, b.index), flow))
+        if count > 0:
+            bisect.insort(self.roll_tiles[number], index)
+        else:
+            self.roll_tiles[number].remove(index)
+
+        resource = Tile.resources.index(resource)
+        width = len(Tile.resources)
+        dots = count * Tile.number_to_dots(number)
+        bit = 1 << number
+        counts = self.production[number - 2]
+        node_dots = self.node_dots
+        node_masks = self.node_masks
+        node_yields = self._node_yields
+        node_production = self.node_production
+
+        for node in self.layout.tile_nodes[index]:
+            counts[node * width + resource] += count
+            node_dots[node] += dots
+
+            # Odds come from the exact yield in dots, so they never drift.
+            yields = node_yields[node]
+            yields[resource] += dots
+            node_production[node][resource] = yields[resource] / 36
+
+            if count > 0:
+                node_masks[node] |= bit
+            elif not any(counts[node * width:(node + 1) * width]):
+                node_masks[node] &= ~bit
+
+    def _update_tiles(self, tiles, old_tiles):
+        """
+        Update the roll lookups after tiles changed.
 
-        return flow_pairs
+        :param tiles: indices of the changed tiles.
+        :param old_tiles: (resource, number) of the tiles before the change.
+        :return: set of indices of the nodes touching the tiles.
+        """
+        for i, (resource, number) in zip(tiles, old_tiles):
+            self._pay_tile(i, resource, number, -1)
 
-    def get_pairwise_fill_rate(self, needs):
-        fill_pairs = []
+        for i in tiles:
+            self._pay_tile(i, self.tiles[i].resource, self.tiles[i].number, 1)
+
+        return {node for i in tiles for node in self.layout.tile_nodes[i]}
+
+    def set_tile(self, index, resource, number):
+        """
+        Set the resource and number of a tile.
 
-        for pair, flow in self.get_pairwise_flow_rate():
+        :param index: index of the tile.
+        :param resource: resource of the tile, None for the desert.
+        :param number: number of the tile, None for the desert.
+        :return:
+        """
+        old_tile = (self.tiles[index].resource, self.tiles[index].number)
+        self.tiles[index].resource = resource
+        self.tiles[index].number = number
+
+        self._update_tiles([index], [old_tile])
+
+    def get_roll_production(self, roll):
+        """
+        Return what every node receives when the roll is made.
+
+        :param roll: roll of 2d6.
+        :return: list of per-resource count tuples, one per node.
+        """
+        if roll not in self.roll_tiles:
+            return [(0,) * len(Tile.resources) for _ in self.nodes]
+
+        width = len(Tile.resources)
+        counts = self.production[roll - 2]
+
+        return [tuple(counts[node * width:(node + 1) * width])
+                for node in range(len(self.nodes))]
+
+    def get_node_score(self, index, metric, needs=None):
+        """
+        Return a node's score by the named metric, from the roll lookups.
+
+        :param index: index of the node.
+        :param metric: name of the metric, one of Board.metrics.
+        :param needs: dictionary of resource needs for 'fill_rate'.
+        :return:
+        """
+        if metric == 'dot_sum':
+            return self.node_dots[index]
+        elif metric == 'hit_frequency':
+            return Tile.mask_to_odds(self.node_masks[index])
+        elif metric == 'flow_rate_no_trades':
+            return self.node_dots[index] / 36
+
+        flow = Port.trade_flow(self.node_production[index],
+                               self.node_ports[index])
+
+        if metric == 'flow_rate':
+            return sum(flow.values())
+
+        needs = needs or {}
+        return max(needs.get(resource, 0) / (flow.get(resource, 0)
+                                             or 1 / 1000000000)
+                   for resource
+                   in set(needs) | set(flow))
+
+    def get_placements(self, k=2):
+        """
+        Return every set of k nodes that can all be settled together.
+
+        :param k: number of settlements in the placement.
+        :return: list of tuples of node indices.
+        """
+        return self.layout.placements(k)
+
+    def get_kwise_dot_sum(self, k):
+        dots = self.node_dots
+
+        return [(placement, sum(dots[i] for i in placement))
+                for placement
+                in self.get_placements(k)]
+
+    def get_kwise_hit_frequency(self, k):
+        # Numbers are kept as bitmasks so a placement's union is a single OR.
+        masks = self.node_masks
+
+        freq_placements = []
+        for placement in self.get_placements(k):
+            mask = 0
+            for i in placement:
+                mask |= masks[i]
+
+            freq_placements.append((placement, Tile.mask_to_odds(mask)))
+
+        return freq_placements
+
+    def get_kwise_flow_rate_no_trades(self, k):
+        flows = [dots / 36 for dots in self.node_dots]
+
+        return [(placement, sum(flows[i] for i in placement))
+                for placement
+                in self.get_placements(k)]
+
+    def get_kwise_flow_rate(self, k):
+        # Production is pooled and traded through every port the placement
+        # owns, so a port on one node also trades the other nodes' income.
+        # The flow is linear in production once the ports are fixed, so it
+        # is the sum of each node's share under the placement's ports. Each
+        # share is worked out the first time its node and ports come up.
+        productions = self.node_production
+        ports = self.node_ports
+        resources = Tile.resources
+        count = len(self.nodes)
+        shares = [None] * (2 ** len(Port.kinds) * count)
+
+        flow_placements = []
+        for placement in self.get_placements(k):
+            mask = 0
+            for i in placement:
+                mask |= ports[i]
+            offset = mask * count
+
+            flow = None
+            for i in placement:
+                share = shares[offset + i]
+                if share is None:
+                    share = shares[offset + i] = tuple(
+                        Port.trade_flow(productions[i], mask).values())
+                flow = (share if flow is None
+                        else tuple(map(operator.add, flow, share)))
+
+            flow_placements.append((placement, dict(zip(resources, flow))))
+
+        return flow_placements
+
+    def get_kwise_fill_rate(self, needs, k):
+        fill_placements = []
+
+        for placement, flow in self.get_kwise_flow_rate(k):
             num_turns = {
                 resource: needs.get(resource, 0) / (
                     flow.get(resource, 0)
@@ -272,9 +458,383 @@ class Board:
                 in set(needs) | set(flow)
             }
 
-            fill_pairs.append((pair, max(num_turns.values())))
+            fill_placements.append((placement, max(num_turns.values())))
+
+        return fill_placements
+
+    def get_scores(self, metric, k=1, needs=None, all_scores=None):
+        """
+        Return the ranked scores of every node, or of every placement of k
+        nodes, by the given metric. Best scores come first.
+
+        :param metric: name of the metric, one of Board.metrics.
+        :param k: number of settlements placed together.
+        :param needs: dictionary of resource needs for 'fill_rate'.
+        :param all_scores: result of get_all_scores(k, needs) to rank
+                           instead of scoring the board again.
+        :return: list of (node index or placement, score) tuples.
+        """
+        if metric not in Board.metrics:
+            raise ValueError('Unknown metric {!r}.'.format(metric))
+
+        if metric == 'fill_rate':
+            needs = needs or {}
+
+        if all_scores is not None:
+            scores = [(key, values[metric]) for key, values in all_scores]
+        elif k == 1:
+            scores = [(i, self.get_node_score(i, metric, needs))
+                      for i
+                      in range(len(self.nodes))]
+        elif metric == 'fill_rate':
+            scores = self.get_kwise_fill_rate(needs, k)
+        elif metric == 'flow_rate':
+            scores = [(placement, sum(flow.values()))
+                      for placement, flow
+                      in self.get_kwise_flow_rate(k)]
+        else:
+            scores = getattr(self, 'get_kwise_' + metric)(k)
+
+        scores.sort(key=lambda x: x[1], reverse=metric != 'fill_rate')
+
+        return scores
+
+    def get_all_scores(self, k=1, needs=None):
+        """
+        Return every metric for every node, or every placement of k nodes,
+        in a single pass. Per-node dots and numbers come from the roll
+        lookups and the traded flow from get_kwise_flow_rate, and are shared
+        by all the metrics.
+
+        :param k: number of settlements placed together.
+        :param needs: dictionary of resource needs for 'fill_rate'.
+        :return: list of (node index or placement, {metric: score}) tuples,
+                 in node or placement order.
+        """
+        needs = needs or {}
+
+        dots = self.node_dots
+        masks = self.node_masks
+        rates = [dots / 36 for dots in self.node_dots]
+
+        fill_needs = [(resource, needs.get(resource, 0))
+                      for resource
+                      in set(needs) | set(Tile.resources)]
+
+        scores = []
+        for placement, flow in self.get_kwise_flow_rate(k):
+            first = placement[0]
+            dot_sum = dots[first]
+            mask = masks[first]
+            rate = rates[first]
+            for i in placement[1:]:
+                dot_sum += dots[i]
+                mask |= masks[i]
+                rate += rates[i]
+
+            fill = max([amount / (flow.get(resource, 0) or 1 / 1000000000)
+                        for resource, amount
+                        in fill_needs])
+
+            scores.append((placement[0] if k == 1 else placement, {
+                'dot_sum': dot_sum,
+                'hit_frequency': Tile.mask_to_odds(mask),
+                'flow_rate_no_trades': rate,
+                'flow_rate': sum(flow.values()),
+                'fill_rate': fill
+            }))
+
+        return scores
+
+    def get_composite_scores(self, weights, k=1, needs=None,
+                             all_scores=None):
+        """
+        Return ranked scores combining several metrics with weights.
+
+        Each metric is rescaled over all candidates so the worst is 0 and
+        the best is 1 before weighting. 'fill_rate' is rescaled on its
+        inverse, turns to fill being unbounded when a resource never comes.
+
+        :param weights: dictionary of metric name to weight.
+        :param k: number of settlements placed together.
+        :param needs: dictionary of resource needs for 'fill_rate'.
+        :param all_scores: result of get_all_scores(k, needs) to combine
+                           instead of scoring the board again.
+        :return: list of (node index or placement, score) tuples.
+        """
+        for metric in weights:
+            if metric not in Board.metrics:
+                raise ValueError('Unknown metric {!r}.'.format(metric))
+
+        if all_scores is None:
+            all_scores = self.get_all_scores(k, needs)
+
+        scales = {}
+        for metric in weights:
+            values = [self._composite_value(metric, scores[metric])
+                      for _, scores in all_scores]
+            low = min(values, default=0)
+            scales[metric] = (low, (max(values, default=0) - low) or 1)
+
+        composite = [
+            (key, sum(weight *
+                      (self._composite_value(metric, scores[metric]) -
+                       scales[metric][0]) / scales[metric][1]
+                      for metric, weight in weights.items()))
+            for key, scores
+            in all_scores
+        ]
+        composite.sort(key=lambda x: x[1], reverse=True)
+
+        return composite
+
+    @staticmethod
+    def _composite_value(metric, score):
+        if metric == 'fill_rate':
+            return 1 / score if score else 0
+
+        return score
+
+    def get_draft(self, seats=4, metric='dot_sum'):
+        """
+        Return the opening settlements of a snake draft, where every seat
+        greedily takes the best node still open by the given metric.
+
+        :param seats: number of players.
+        :param metric: name of the metric used to pick nodes.
+        :return: list of node indices picked by each seat.
+        """
+        if seats < 1:
+            raise ValueError('seats must be at least 1.')
+
+        ranked = [index for index, _ in self.get_scores(metric)]
+        blocked = set()
+        picks = [[] for _ in range(seats)]
+
+        for seat in list(range(seats)) + list(reversed(range(seats))):
+            index = next((i for i in ranked if i not in blocked), None)
+            if index is None:
+                raise ValueError(
+                    'No open node left for seat {} of {}.'.format(seat + 1,
+                                                                  seats))
+            picks[seat].append(index)
+            blocked.add(index)
+            blocked.update(node.index for node in self.nodes[index].neighbors)
+
+        return picks
+
+    def get_pairwise_dot_sum(self):
+        return self.get_kwise_dot_sum(2)
+
+    def get_pairwise_hit_frequency(self):
+        return self.get_kwise_hit_frequency(2)
+
+    def get_pairwise_flow_rate_no_trades(self):
+        return self.get_kwise_flow_rate_no_trades(2)
+
+    def get_pairwise_flow_rate(self):
+        return self.get_kwise_flow_rate(2)
+
+    def get_pairwise_fill_rate(self, needs):
+        return self.get_kwise_fill_rate(needs, 2)
+
+
+class Layout:
+    """
+    Object describing the shape of a Settlers of Catan board.
+
+    Tiles are given as axial hex coordinates (q, r) of pointy-topped hexes.
+    Everything else (nodes, their tiles and neighbors, the coastline, port
+    positions and drawing coordinates) is derived from them.
+    """
+
+    _cache = {}
+
+    @classmethod
+    def base(cls):
+        """
+        Return the layout of the 19 tile base board.
+
+        :return:
+        """
+        if 'base' not in cls._cache:
+            cls._cache['base'] = cls.from_rows(
+                [3, 4, 5, 4, 3],
+                resources=(['lumber'] * 4) +
+                          (['grain'] * 4) +
+                          (['brick'] * 3) +
+                          (['ore'] * 3) +
+                          (['wool'] * 4),
+                numbers=[2, 3, 3, 4, 4, 5, 5, 6, 6,
+                         8, 8, 9, 9, 10, 10, 11, 11, 12],
+                port_resources=['all', 'grain', 'ore', 'all', 'wool',
+                                'all', 'all', 'brick', 'lumber']
+            )
+
+        return cls._cache['base']
+
+    @classmethod
+    def expansion(cls):
+        """
+        Return the layout of the 30 tile 5-6 player expansion board.
+
+        :return:
+        """
+        if 'expansion' not in cls._cache:
+            cls._cache['expansion'] = cls.from_rows(
+                [3, 4, 5, 6, 5, 4, 3],
+                resources=(['lumber'] * 6) +
+                          (['grain'] * 6) +
+                          (['brick'] * 5) +
+                          (['ore'] * 5) +
+                          (['wool'] * 6),
+                numbers=[2, 2, 3, 3, 3, 4, 4, 4, 5, 5, 5, 6, 6, 6,
+                         8, 8, 8, 9, 9, 9, 10, 10, 10, 11, 11, 11, 12, 12],
+                port_resources=['all', 'grain', 'ore', 'all', 'wool', 'all',
+                                'wool', 'all', 'brick', 'lumber', 'all']
+            )
+
+        return cls._cache['expansion']
+
+    @classmethod
+    def named(cls, name):
+        """
+        Return a layout by name, 'base' or 'expansion'.
+
+        :param name: name of the layout.
+        :return:
+        """
+        if name == 'base':
+            return cls.base()
+        elif name == 'expansion':
+            return cls.expansion()
+
+        raise ValueError('Unknown layout {!r}.'.format(name))
+
+    @classmethod
+    def from_rows(cls, rows, **kwargs):
+        """
+        Return a layout of centered rows of tiles, e.g. [3, 4, 5, 4, 3].
+
+        :param rows: number of tiles in each row, top to bottom.
+        :return:
+        """
+        widest = max(rows)
+        middle = rows.index(widest)
+
+        tiles = []
+        for row, length in enumerate(rows):
+            r = row - middle
+            offset = widest - length
+            if (offset - r) % 2:
+                raise ValueError('Row {} cannot be centered.'.format(row))
+
+            for i in range(length):
+                tiles.append(((offset + 2 * i - r) // 2, r))
+
+        return cls(tiles, **kwargs)
+
+    def __init__(self, tiles, resources=(), numbers=(), port_resources=()):
+        """
+        Initialize the layout and derive the board topology.
+
+        Positions are kept in integer units of half a hex width (x) and a
+        quarter of a hex height (y), so shared corners compare exactly.
+
+        :param tiles: list of axial (q, r) coordinates, in board order.
+        :param resources: resources dealt onto the tiles.
+        :param numbers: numbers dealt onto the tiles.
+        :param port_resources: resources of the ports, clockwise.
+        """
+        self.tiles = list(tiles)
+        self.resources = list(resources)
+        self.numbers = list(numbers)
+        self.deserts = len(self.tiles) - len(self.resources)
+
+        # Corners of every tile, clockwise from the top.
+        corners = []
+        for q, r in self.tiles:
+            x, y = 2 * q + r, 3 * r
+            corners.append([(x, y), (x + 1, y + 1), (x + 1, y + 3),
+                            (x, y + 4), (x - 1, y + 3), (x - 1, y + 1)])
+
+        min_x = min(x for tile in corners for x, _ in tile)
+        min_y = min(y for tile in corners for _, y in tile)
+        corners = [[(x - min_x, y - min_y) for x, y in tile]
+                   for tile in corners]
+
+        self.tile_positions = [tile[0] for tile in corners]
+        self.nodes = sorted({corner for tile in corners for corner in tile},
+                            key=lambda node: (node[1], node[0]))
+        self.width = max(x for x, _ in self.nodes)
+        self.height = max(y for _, y in self.nodes)
+
+        index = {node: i for i, node in enumerate(self.nodes)}
+
+        self.node_tiles = [[] for _ in self.nodes]
+        neighbors = [set() for _ in self.nodes]
+        edges = {}
+        for t, tile in enumerate(corners):
+            for j, corner in enumerate(tile):
+                a, b = index[corner], index[tile[(j + 1) % 6]]
+                self.node_tiles[a].append(t)
+                neighbors[a].add(b)
+                neighbors[b].add(a)
+                edges.setdefault(frozenset((a, b)), []).append((a, b))
+
+        self.node_neighbors = [sorted(n) for n in neighbors]
+        self.tile_nodes = [sorted(index[corner] for corner in tile)
+                           for tile in corners]
+
+        # Edges on a single tile form the coast. Walk it clockwise, starting
+        # with the edge leading into the top left-most node.
+        following = {a: b
+                     for sides in edges.values()
+                     if len(sides) == 1
+                     for a, b in sides}
+        start = next(a for a, b in following.items() if b == 0)
+        self.coast = [(start, 0)]
+        while self.coast[-1][1] != start:
+            a = self.coast[-1][1]
+            self.coast.append((a, following[a]))
+
+        # Ports are spread evenly along the coast.
+        self.ports = []
+        for i, resource in enumerate(port_resources):
+            a, b = self.coast[
+                int(i * len(self.coast) / len(port_resources) + 0.5)]
+            self.ports.append((resource, tuple(sorted((a, b)))))
+
+        self._placements = {}
+
+    def placements(self, k):
+        """
+        Return every set of k mutually non-adjacent nodes, in the order of
+        itertools.combinations.
+
+        :param k: number of settlements in the placement.
+        :return: list of tuples of node indices.
+        """
+        if k not in self._placements:
+            blocked = [sum(1 << j for j in [i] + neighbors)
+                       for i, neighbors in enumerate(self.node_neighbors)]
+            count = len(self.nodes)
+            placements = []
 
-        return fill_pairs
+            def extend(placement, start, mask):
+                if len(placement) == k:
+                    placements.append(tuple(placement))
+                    return
+                for i in range(start, count - (k - len(placement)) + 1):
+                    if not mask & (1 << i):
+                        placement.append(i)
+                        extend(placement, i + 1, mask | blocked[i])
+                        placement.pop()
+
+            extend([], 0, 0)
+            self._placements[k] = placements
+
+        return self._placements[k]
 
 
 class Tile:
@@ -283,6 +843,9 @@ class Tile:
     """
 
     resources = ['brick', 'lumber', 'ore', 'grain', 'wool']
+    numbers = [2, 3, 4, 5, 6, 8, 9, 10, 11, 12]
+
+    _mask_odds = {}
 
     @classmethod
     def number_to_dots(cls, number):
@@ -308,6 +871,22 @@ class Tile:
         """
         return Tile.number_to_dots(self.number)
 
+    @classmethod
+    def mask_to_odds(cls, mask):
+        """
+        Return the odds of any number in a bitmask being rolled on 2d6.
+
+        :param mask: integer with bit n set for every number n.
+        :return: odds out of 1 of any of the numbers being rolled
+        """
+        if mask not in cls._mask_odds:
+            cls._mask_odds[mask] = sum((Tile.number_to_dots(num) / 36)
+                                       for num
+                                       in range(2, 13)
+                                       if mask & (1 << num))
+
+        return cls._mask_odds[mask]
+
     def get_odds(self):
         """
         Return the odds of this tile's number being rolled on 2d6.
@@ -332,6 +911,54 @@ class Port:
     Object representing a port in Settlers of Catan.
     """
 
+    kinds = ['all'] + Tile.resources
+
+    _trade_rates = {}
+
+    @classmethod
+    def trade_rates(cls, mask):
+        """
+        Return the rate each resource trades at when owning the ports in
+        the mask, in the order of Tile.resources. There are only 64 sets
+        of port kinds, so every set is worked out once and kept.
+
+        :param mask: integer with bit i set for each owned Port.kinds[i].
+        :return: tuple of trade rates
+        """
+        if mask not in cls._trade_rates:
+            cls._trade_rates[mask] = tuple(
+                1 / 2 if mask & (1 << cls.kinds.index(resource))
+                else 1 / 3 if mask & 1
+                else 1 / 4
+                for resource
+                in Tile.resources
+            )
+
+        return cls._trade_rates[mask]
+
+    @classmethod
+    def trade_flow(cls, production, mask):
+        """
+        Return the flow rate of a production when every resource can be
+        traded at the best rate of the owned ports.
+
+        :param production: odds of producing each resource, in the order of
+                           Tile.resources.
+        :param mask: integer with bit i set for each owned Port.kinds[i].
+        :return: dictionary of resource flow rates
+        """
+        rates = cls.trade_rates(mask)
+
+        # Every resource produced can be traded for any other one, so each
+        # resource gets the whole traded pool less its own share.
+        traded = sum(map(operator.mul, production, rates))
+
+        return {
+            resource: odds * (1 - rate) + traded
+            for resource, odds, rate
+            in zip(Tile.resources, production, rates)
+        }
+
     def __init__(self, index, resource=None):
         """
         Initialize the Port object.
@@ -401,41 +1028,38 @@ class Node:
                    for tile
                    in self.tiles)
 
-    def get_flow_rate(self):
+    def get_production(self):
         """
-        Return the per resource flow rate.
-        Flow rate described as Amount per Turn * Tile Odds.
-        :return:
+        Return the odds of the node producing each resource.
+        :return: tuple in the order of Tile.resources.
         """
-        flow = {resource: 0 for resource in Tile.resources}
+        production = [0] * len(Tile.resources)
         for tile in self.tiles:
-            trade_rate = 1 / 4
-            if self.ports:
-                port_resources = [port.resource for port in self.ports]
-                if tile.resource in port_resources:
-                    trade_rate = 1 / 2
-                elif 'all' in port_resources:
-                    trade_rate = 1 / 3
-
-            hit_odds = tile.get_odds()
-
-            tile_flow = {
-                resource: trade_rate * hit_odds
-                for resource
-                in Tile.resources
-                if resource != tile.resource
-            }
-
             if tile.resource:
-                tile_flow[tile.resource] = hit_odds
+                production[Tile.resources.index(tile.resource)] += \
+                    tile.get_odds()
 
-            flow = {
-                resource: tile_flow.get(resource, 0) + flow.get(resource, 0)
-                for resource
-                in set(tile_flow) | set(flow)
-            }
+        return tuple(production)
+
+    def get_port_mask(self):
+        """
+        Return the kinds of port on the node as a bitmask.
+        :return: integer with bit i set for each Port.kinds[i].
+        """
+        mask = 0
+        for port in self.ports:
+            if port.resource in Port.kinds:
+                mask |= 1 << Port.kinds.index(port.resource)
+
+        return mask
 
-        return flow
+    def get_flow_rate(self):
+        """
+        Return the per resource flow rate.
+        Flow rate described as Amount per Turn * Tile Odds.
+        :return:
+        """
+        return Port.trade_flow(self.get_production(), self.get_port_mask())
 
     def get_fill_rate(self, needs):
         """
@@ -459,6 +1083,1077 @@ class Node:
         return max(num_turns.values())
 
 
+class BoardAnnealer:
+    """
+    Searches for balanced, or deliberately skewed, boards by simulated
+    annealing over tile and number swaps.
+
+    The objective is the gap between the best node and the rank-th best
+    node by a metric, e.g. with rank 8 the gap between the first pick and
+    the last pick of a four player draft. Node scores are kept between
+    moves, and a swap only re-scores the nodes on the two swapped tiles.
+    """
+
+    def __init__(self, board, metric='dot_sum', rank=8, skew=False,
+                 needs=None, seed=None):
+        """
+        Initialize the search from the board, which is changed in place.
+
+        :param board: Board to search from.
+        :param metric: name of the metric, one of Board.metrics.
+        :param rank: rank of the node compared against the best node.
+        :param skew: maximize the gap instead of minimizing it.
+        :param needs: dictionary of resource needs for 'fill_rate',
+                      defaults to 10 of each resource.
+        :param seed: seed of the move randomizer.
+        """
+        if metric not in Board.metrics:
+            raise ValueError('Unknown metric {!r}.'.format(metric))
+        if rank < 1:
+            raise ValueError('rank must be at least 1.')
+
+        self.board = board
+        self.metric = metric
+        self.rank = rank
+        self.skew = skew
+        self.needs = needs or {resource: 10 for resource in Tile.resources}
+        self.random = random.Random(seed)
+
+        self.scores = [board.get_node_score(i, metric, self.needs)
+                       for i in range(len(board.nodes))]
+        self.cost = self.get_cost()
+
+    def get_gap(self):
+        """
+        Return the gap between the best node and the rank-th best node.
+
+        :return:
+        """
+        if self.metric == 'fill_rate':
+            top = heapq.nsmallest(self.rank, self.scores)
+        else:
+            top = heapq.nlargest(self.rank, self.scores)
+
+        return abs(top[0] - top[-1])
+
+    def get_cost(self):
+        return -self.get_gap() if self.skew else self.get_gap()
+
+    def swap(self, a, b, numbers_only):
+        """
+        Swap two tiles and re-score only the nodes touching them.
+
+        :return: list of (node index, old score) to undo the swap with.
+        """
+        changed = []
+        for i in self.board.swap_tiles(a, b, numbers_only):
+            changed.append((i, self.scores[i]))
+            self.scores[i] = self.board.get_node_score(i, self.metric,
+                                                       self.needs)
+
+        return changed
+
+    def run(self, moves=10000, temperature=None, final_temperature=None):
+        """
+        Anneal for a number of moves and leave the board at the best
+        state found.
+
+        :param moves: number of swap moves to try.
+        :param temperature: starting temperature, defaults to a tenth of
+                            the starting gap.
+        :param final_temperature: temperature of the last move, defaults to
+                                  a thousandth of the starting temperature.
+        :return: dictionary of search statistics.
+        """
+        if temperature is None:
+            temperature = abs(self.cost) / 10 or 0.1
+        if final_temperature is None:
+            final_temperature = temperature / 1000
+        if temperature <= 0 or final_temperature <= 0:
+            raise ValueError('Temperatures must be above 0.')
+        cooling = (final_temperature / temperature) ** (1 / max(moves, 1))
+
+        tiles = range(len(self.board.tiles))
+        best_cost = self.cost
+        best = [(tile.resource, tile.number) for tile in self.board.tiles]
+        accepted = 0
+
+        started = time.monotonic()
+        for _ in range(moves):
+            a, b = self.random.sample(tiles, 2)
+            numbers_only = (self.random.random() < 0.5 and
+                            self.board.tiles[a].resource is not None and
+                            self.board.tiles[b].resource is not None)
+
+            changed = self.swap(a, b, numbers_only)
+            cost = self.get_cost()
+
+            if (cost <= self.cost or
+                    self.random.random() <
+                    math.exp((self.cost - cost) / temperature)):
+                self.cost = cost
+                accepted += 1
+
+                if cost < best_cost:
+                    best_cost = cost
+                    best = [(tile.resource, tile.number)
+                            for tile in self.board.tiles]
+            else:
+                self.board.swap_tiles(a, b, numbers_only)
+                for i, score in changed:
+                    self.scores[i] = score
+
+            temperature *= cooling
+        elapsed = time.monotonic() - started
+
+        for i, (resource, number) in enumerate(best):
+            self.board.set_tile(i, resource, number)
+        self.scores = [self.board.get_node_score(i, self.metric, self.needs)
+                       for i in range(len(self.board.nodes))]
+        self.cost = best_cost
+
+        return {
+            'moves': moves,
+            'accepted': accepted,
+            'gap': self.get_gap(),
+            'seconds': elapsed,
+            'moves_per_second': moves / elapsed if elapsed else 0
+        }
+
+
+class BatchScorer:
+    """
+    Scores a stream of board descriptions without the GUI.
+
+    Boards are read from JSONL or CSV and written back as one JSON line per
+    board, in input order, however many workers are used. Only a bounded
+    window of chunks is ever in flight, so arbitrarily long streams can be
+    piped through.
+
+    A JSONL line is either a list of [resource, number] pairs or an object
+    with "tiles" and optional "id", "ports" ([resource, [node, node]] pairs)
+    and "layout" ('base' or 'expansion') keys. A CSV file has a header with a
+    "tiles" column of space separated resource:number tokens (or 'desert')
+    and optional "id", "ports" (resource:node-node tokens) and "layout"
+    columns.
+    """
+
+    def __init__(self, metrics=('dot_sum',), k=1, needs=None, top=10,
+                 workers=1, chunk_size=64, weights=None):
+        """
+        Initialize the scorer.
+
+        :param metrics: names of the metrics to score, from Board.metrics.
+        :param k: number of settlements placed together.
+        :param needs: dictionary of resource needs for 'fill_rate'.
+        :param top: number of best scores written per metric, 0 for all.
+        :param workers: number of worker processes.
+        :param chunk_size: number of boards handed to a worker at once.
+        :param weights: optional metric weights of a 'composite' ranking.
+        """
+        for metric in list(metrics) + list(weights or {}):
+            if metric not in Board.metrics:
+                raise ValueError('Unknown metric {!r}.'.format(metric))
+        if not 1 <= k <= ScoringService.max_k:
+            raise ValueError('k must be from 1 to {}.'.format(
+                ScoringService.max_k))
+
+        self.metrics = list(metrics)
+        self.k = k
+        self.needs = needs or {resource: 10 for resource in Tile.resources}
+        self.top = top
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.weights = weights
+
+    @staticmethod
+    def read(stream, fmt='jsonl'):
+        """
+        Yield raw records from the stream, one per board.
+
+        :param stream: text stream to read.
+        :param fmt: 'jsonl' or 'csv'.
+        :return:
+        """
+        if fmt == 'csv':
+            yield from csv.DictReader(stream)
+        elif fmt == 'jsonl':
+            for line in stream:
+                if line.strip():
+                    yield line
+        else:
+            raise ValueError('Unknown format {!r}.'.format(fmt))
+
+    @staticmethod
+    def parse(record):
+        """
+        Return the id and Board of a raw JSONL line or CSV row.
+
+        :param record: string line or dictionary row.
+        :return: tuple of (id or None, Board).
+        """
+        if isinstance(record, str):
+            data = json.loads(record)
+            if isinstance(data, list):
+                data = {'tiles': data}
+            elif not isinstance(data, dict):
+                raise ValueError('Expected a list or an object.')
+        else:
+            if not record.get('tiles'):
+                raise ValueError('Missing tiles.')
+
+            data = {
+                'id': record.get('id') or None,
+                'layout': record.get('layout') or None,
+                'tiles': [
+                    token.split(':') if ':' in token else (token, None)
+                    for token
+                    in record['tiles'].split()
+                ],
+                'ports': [
+                    (token.split(':')[0], token.split(':')[1].split('-'))
+                    for token
+                    in (record.get('ports') or '').split()
+                ]
+            }
+            data['ports'] = [(resource, [int(node) for node in nodes])
+                             for resource, nodes
+                             in data['ports']]
+
+        if not data.get('tiles'):
+            raise ValueError('Missing tiles.')
+
+        return data.get('id'), Board.from_description(data['tiles'],
+                                                      data.get('ports'),
+                                                      data.get('layout'))
+
+    @staticmethod
+    def record_id(record):
+        """
+        Return the id of a raw record that may not parse as a board.
+
+        :param record: string line or dictionary row.
+        :return: id, or None when there is none or it cannot be read.
+        """
+        if not isinstance(record, str):
+            return record.get('id') or None
+
+        try:
+            data = json.loads(record)
+        except ValueError:
+            return None
+
+        return data.get('id') if isinstance(data, dict) else None
+
+    def score(self, board):
+        """
+        Return the best scores of the board for every metric.
+
+        :param board: Board to score.
+        :return: dictionary of metric name to list of (key, score) tuples.
+        """
+        results = {}
+
+        all_scores = None
+        if len(self.metrics) > 1 or self.weights:
+            # One fused pass is cheaper than a pass per metric.
+            all_scores = board.get_all_scores(self.k, self.needs)
+
+        for metric in self.metrics:
+            results[metric] = board.get_scores(metric, self.k, self.needs,
+                                               all_scores)
+
+        if self.weights:
+            results['composite'] = board.get_composite_scores(
+                self.weights, self.k, self.needs, all_scores)
+
+        if self.top:
+            results = {metric: scores[:self.top]
+                       for metric, scores
+                       in results.items()}
+
+        return results
+
+    def score_record(self, index, record):
+        """
+        Return the output line for one raw record. Records that cannot be
+        read produce an error line instead of stopping the stream.
+
+        :param index: position of the record in the input.
+        :param record: raw record from BatchScorer.read.
+        :return: JSON string.
+        """
+        try:
+            board_id, board = self.parse(record)
+        except (ValueError, KeyError, TypeError, IndexError,
+                AttributeError) as error:
+            board_id = self.record_id(record)
+            return json.dumps({
+                'id': index if board_id is None else board_id,
+                'error': str(error)
+            })
+
+        return json.dumps({
+            'id': index if board_id is None else board_id,
+            'scores': self.score(board)
+        })
+
+    def score_chunk(self, chunk):
+        return [self.score_record(index, record) for index, record in chunk]
+
+    def run(self, records):
+        """
+        Yield output lines for the records, in input order.
+
+        :param records: iterable of raw records.
+        :return:
+        """
+        records = enumerate(records)
+        chunks = iter(lambda: list(itertools.islice(records, self.chunk_size)),
+                      [])
+
+        if self.workers <= 1:
+            for chunk in chunks:
+                yield from self.score_chunk(chunk)
+            return
+
+        with multiprocessing.Pool(self.workers) as pool:
+            pending = collections.deque()
+            for chunk in chunks:
+                pending.append(pool.apply_async(self.score_chunk, (chunk,)))
+
+                if len(pending) >= 2 * self.workers:
+                    yield from pending.popleft().get()
+
+            while pending:
+                yield from pending.popleft().get()
+
+
+class Corpus:
+    """
+    Per-board statistics over a range of Board.random_board seeds, stored
+    as a .npy file of records, one per seed.
+
+    Workers write their rows straight into the memory-mapped file, so no
+    results are sent back between processes, and reading only maps the
+    file rather than loading it. NumPy can open the same file with
+    numpy.load(path, mmap_mode='r').
+    """
+
+    fields = ['best_dot_sum', 'best_pair_flow', 'seat_spread']
+    record = struct.Struct('<' + 'd' * len(fields))
+
+    @classmethod
+    def build(cls, path, start, count, workers=1, layout='base', seats=4,
+              shard_size=None):
+        """
+        Analyze the seeds start to start + count and write them to path.
+
+        :param path: .npy file to write.
+        :param start: first seed.
+        :param count: number of seeds.
+        :param workers: number of worker processes.
+        :param layout: name of the board layout.
+        :param seats: number of players in the seat spread draft.
+        :param shard_size: number of seeds handed to a worker at once,
+                           by default about four shards per worker.
+        :return: Corpus reading the new file.
+        """
+        if shard_size is None:
+            shard_size = min(1000, max(1, math.ceil(
+                count / (4 * max(workers, 1)))))
+
+        header = cls._header(count)
+
+        # Preallocate the whole file so workers only ever write into it.
+        with open(path, 'wb') as f:
+            f.write(header)
+            f.truncate(len(header) + count * cls.record.size)
+
+        shards = [(path, len(header), start, i, min(i + shard_size, count),
+                   layout, seats)
+                  for i in range(0, count, shard_size)]
+
+        if workers <= 1:
+            for shard in shards:
+                cls._fill(*shard)
+        else:
+            with multiprocessing.Pool(workers) as pool:
+                pool.starmap(cls._fill, shards, chunksize=1)
+
+        return cls(path)
+
+    @classmethod
+    def merge(cls, path, paths):
+        """
+        Concatenate corpora, in order, into a new file at path.
+
+        :param path: .npy file to write.
+        :param paths: .npy files written by Corpus.build.
+        :return: Corpus reading the new file.
+        """
+        parts = [cls(part) for part in paths]
+
+        try:
+            with open(path, 'wb') as f:
+                f.write(cls._header(sum(len(part) for part in parts)))
+                for part in parts:
+                    f.write(part._data[part._offset:
+                                       part._offset + len(part) *
+                                       cls.record.size])
+        finally:
+            for part in parts:
+                part.close()
+
+        return cls(path)
+
+    @classmethod
+    def analyze(cls, board, seats=4):
+        """
+        Return the statistics of a board, in the order of Corpus.fields.
+
+        :param board: Board to analyze.
+        :param seats: number of players in the seat spread draft.
+        :return: tuple of floats.
+        """
+        dots = board.node_dots
+        seat_dots = [sum(dots[i] for i in picks)
+                     for picks in board.get_draft(seats)]
+
+        return (
+            max(dots),
+            board.get_scores('flow_rate', 2)[0][1],
+            max(seat_dots) - min(seat_dots)
+        )
+
+    @classmethod
+    def _header(cls, count):
+        """
+        Return the .npy (version 1.0) header for count records.
+
+        :param count: number of records.
+        :return: bytes
+        """
+        header = "{{'descr': [{}], 'fortran_order': False, 'shape': ({},), }}"
+        header = header.format(
+            ', '.join("('{}', '<f8')".format(field) for field in cls.fields),
+            count)
+
+        # Pad so the data starts on a 64 byte boundary.
+        length = len(header) + 1
+        length += -(10 + length) % 64
+
+        return (b'\x93NUMPY\x01\x00' + struct.pack('<H', length) +
+                header.ljust(length - 1).encode('latin1') + b'\n')
+
+    @classmethod
+    def _fill(cls, path, offset, seed, first, last, layout, seats):
+        """
+        Analyze the rows first to last and write them in place.
+
+        :return:
+        """
+        layout = Layout.named(layout)
+
+        with open(path, 'r+b') as f:
+            with mmap.mmap(f.fileno(), 0) as data:
+                for row in range(first, last):
+                    board = Board.random_board(seed + row, layout)
+                    cls.record.pack_into(data,
+                                         offset + row * cls.record.size,
+                                         *cls.analyze(board, seats))
+                data.flush()
+
+    def __init__(self, path):
+        """
+        Map an existing corpus for reading.
+
+        :param path: .npy file written by Corpus.build.
+        """
+        self.path = path
+        self._file = open(path, 'rb')
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self._data[:6] != b'\x93NUMPY':
+            raise ValueError('{} is not a .npy file.'.format(path))
+
+        length, = struct.unpack_from('<H', self._data, 8)
+        header = ast.literal_eval(self._data[10:10 + length].decode('latin1'))
+
+        if [name for name, _ in header['descr']] != self.fields:
+            raise ValueError('{} is not a corpus.'.format(path))
+
+        self._offset = 10 + length
+        self.count = header['shape'][0]
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, row):
+        """
+        Return the statistics of one row.
+
+        :param row: index of the row, seed minus the first seed.
+        :return: tuple of floats, in the order of Corpus.fields.
+        """
+        if not 0 <= row < self.count:
+            raise IndexError(row)
+
+        return self.record.unpack_from(self._data,
+                                       self._offset + row * self.record.size)
+
+    def column(self, field):
+        """
+        Yield every value of one field, without loading the file.
+
+        :param field: name of the field.
+        :return:
+        """
+        column = self.fields.index(field)
+        for row in range(self.count):
+            yield self[row][column]
+
+    def histogram(self, field, bins=20):
+        """
+        Return a histogram of one field, as evenly sized bins.
+
+        :param field: name of the field.
+        :param bins: number of bins.
+        :return: dictionary of 'edges' and 'counts'.
+        """
+        low = min(self.column(field), default=0)
+        high = max(self.column(field), default=0)
+        width = (high - low) / bins or 1
+
+        counts = [0] * bins
+        for value in self.column(field):
+            counts[min(int((value - low) / width), bins - 1)] += 1
+
+        return {
+            'edges': [low + i * width for i in range(bins + 1)],
+            'counts': counts
+        }
+
+    def summary(self, bins=20):
+        """
+        Return histograms of every field.
+
+        :param bins: number of bins.
+        :return:
+        """
+        return {
+            'count': self.count,
+            'histograms': {field: self.histogram(field, bins)
+                           for field in self.fields}
+        }
+
+    def close(self):
+        self._data.close()
+        self._file.close()
+
+
+class Sweep:
+    """
+    A resumable Corpus over a range of seeds, kept in a directory.
+
+    The range is cut into shards of consecutive seeds. Every finished shard
+    is written to its own file and then appended to a checkpoint file, so
+    a sweep that is stopped part way picks up again from the unfinished
+    shards. Shards are merged in seed order, so the result does not depend
+    on how many workers ran or how often the sweep was restarted.
+    """
+
+    def __init__(self, directory, start=0, count=1000, shard_size=1000,
+                 layout='base', seats=4):
+        """
+        Open the sweep in directory, creating it if needed.
+
+        :param directory: directory holding the sweep.
+        :param start: first seed.
+        :param count: number of seeds.
+        :param shard_size: number of seeds in a shard.
+        :param layout: name of the board layout.
+        :param seats: number of players in the seat spread draft.
+        """
+        self.directory = directory
+        self.settings = {
+            'start': start,
+            'count': count,
+            'shard_size': shard_size,
+            'layout': layout,
+            'seats': seats
+        }
+
+        os.makedirs(directory, exist_ok=True)
+        settings_path = os.path.join(directory, 'sweep.json')
+
+        if os.path.exists(settings_path):
+            with open(settings_path) as f:
+                if json.load(f) != self.settings:
+                    raise ValueError(
+                        '{} holds a sweep with other settings.'.format(
+                            directory))
+        else:
+            with open(settings_path, 'w') as f:
+                json.dump(self.settings, f)
+
+        self.shards = [(i, start + first, min(shard_size, count - first))
+                       for i, first
+                       in enumerate(range(0, count, shard_size))]
+
+    def shard_path(self, shard):
+        return os.path.join(self.directory, 'shard-{:06d}.npy'.format(shard))
+
+    def completed(self):
+        """
+        Return the shards recorded in the checkpoint file.
+
+        :return: set of shard indices.
+        """
+        try:
+            with open(os.path.join(self.directory, 'checkpoint')) as f:
+                lines = f.read().split('\n')
+        except FileNotFoundError:
+            return set()
+
+        # The last entry is only complete once its newline is written.
+        return {int(line)
+                for line in lines[:-1]
+                if os.path.exists(self.shard_path(int(line)))}
+
+    def pending(self):
+        done = self.completed()
+
+        return [shard for shard in self.shards if shard[0] not in done]
+
+    def run(self, workers=1):
+        """
+        Run every unfinished shard, checkpointing each as it finishes.
+
+        :param workers: number of worker processes.
+        :return:
+        """
+        pending = self.pending()
+
+        with open(os.path.join(self.directory, 'checkpoint'), 'a+') as f:
+            # Drop an entry cut off mid-write so new ones start on a line
+            # of their own.
+            f.seek(0)
+            f.truncate(f.read().rfind('\n') + 1)
+
+            if workers <= 1:
+                finished = map(self._run_shard, pending)
+            else:
+                pool = multiprocessing.Pool(workers)
+                finished = pool.imap_unordered(self._run_shard, pending)
+
+            try:
+                for shard in finished:
+                    f.write('{}\n'.format(shard))
+                    f.flush()
+                    os.fsync(f.fileno())
+            finally:
+                if workers > 1:
+                    pool.terminate()
+
+    def _run_shard(self, shard):
+        """
+        Analyze one shard into its own file.
+
+        :param shard: tuple of (index, first seed, number of seeds).
+        :return: index of the shard.
+        """
+        index, seed, count = shard
+        path = self.shard_path(index)
+
+        # Written aside and then renamed, so a shard file is never partial.
+        Corpus.build(path + '.tmp', seed, count,
+                     layout=self.settings['layout'],
+                     seats=self.settings['seats']).close()
+        os.replace(path + '.tmp', path)
+
+        return index
+
+    def merge(self, path=None):
+        """
+        Merge every shard into one corpus, in seed order.
+
+        :param path: .npy file to write, defaults to corpus.npy in the sweep.
+        :return: Corpus reading the merged file.
+        """
+        if self.pending():
+            raise ValueError('{} has {} unfinished shards.'.format(
+                self.directory, len(self.pending())))
+
+        return Corpus.merge(
+            path or os.path.join(self.directory, 'corpus.npy'),
+            [self.shard_path(index) for index, _, _ in self.shards])
+
+
+class ScoringService:
+    """
+    Ranks nodes or placements for boards sent over local HTTP as JSON.
+
+    Requests are queued and scored by a single thread in micro-batches:
+    everything that arrives within batch_wait seconds (up to batch_size
+    requests) is scored together, each distinct board being built once,
+    and answers are kept in an LRU cache for repeated requests.
+
+    POST /score takes a board description as read by BatchScorer, plus
+    "metric", "mode" ('single' or 'pairwise') or "k", "needs" and "top",
+    and returns {"scores": [[node or placement, score], ...]}. The metric
+    'composite' ranks by "weights" of several metrics.
+    GET /metrics returns request, cache, batch and latency counters.
+    """
+
+    # Placements grow combinatorially with k, so only small k are served.
+    max_k = 3
+
+    def __init__(self, batch_size=32, batch_wait=0.002, cache_size=4096,
+                 timeout=30):
+        """
+        Initialize the service and start the batching thread.
+
+        :param batch_size: most requests scored in one batch.
+        :param batch_wait: seconds to wait for a batch to fill.
+        :param cache_size: number of answers kept in the cache.
+        :param timeout: seconds a request waits for its answer.
+        """
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.cache_size = cache_size
+        self.timeout = timeout
+
+        self._queue = queue.Queue()
+        self._cache = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._latencies = collections.deque(maxlen=10000)
+        self._started = time.monotonic()
+        self.counters = {
+            'requests': 0,
+            'errors': 0,
+            'cache_hits': 0,
+            'batches': 0,
+            'batched_requests': 0,
+            'boards_built': 0,
+            'fused_passes': 0
+        }
+
+        threading.Thread(target=self._batcher, daemon=True).start()
+
+    @staticmethod
+    def parse(data):
+        """
+        Return the canonical form of a request, used as its cache key.
+
+        :param data: dictionary decoded from the request body.
+        :return: tuple of (board key, metric, k, needs, weights, top).
+        """
+        metric = data.get('metric', 'dot_sum')
+        if metric not in Board.metrics + ['composite']:
+            raise ValueError('Unknown metric {!r}.'.format(metric))
+
+        mode = data.get('mode', 'single')
+        if mode not in ('single', 'pairwise'):
+            raise ValueError('Unknown mode {!r}.'.format(mode))
+        k = int(data.get('k', 2 if mode == 'pairwise' else 1))
+        if not 1 <= k <= ScoringService.max_k:
+            raise ValueError('k must be from 1 to {}.'.format(
+                ScoringService.max_k))
+
+        weights = ()
+        if metric == 'composite':
+            weights = tuple(sorted((metric, float(weight))
+                                   for metric, weight
+                                   in data['weights'].items()))
+
+        needs = ()
+        if metric == 'fill_rate' or 'fill_rate' in dict(weights):
+            needs = tuple(sorted(
+                dict({resource: 10 for resource in Tile.resources},
+                     **data.get('needs', {})).items()))
+
+        board = json.dumps([data['tiles'], data.get('ports'),
+                            data.get('layout')])
+
+        return board, metric, k, needs, weights, int(data.get('top', 10))
+
+    def submit(self, data):
+        """
+        Queue a request for the next batch.
+
+        :param data: dictionary decoded from the request body.
+        :return: Future of the list of (key, score) tuples.
+        """
+        future = concurrent.futures.Future()
+
+        try:
+            request = self.parse(data)
+        except KeyError as error:
+            future.set_exception(ValueError('Missing {}.'.format(error)))
+            return future
+        except (ValueError, TypeError, AttributeError) as error:
+            future.set_exception(ValueError(str(error)))
+            return future
+
+        with self._lock:
+            self.counters['requests'] += 1
+            if request in self._cache:
+                self._cache.move_to_end(request)
+                self.counters['cache_hits'] += 1
+                future.set_result(self._cache[request])
+                return future
+
+        self._queue.put((request, future))
+
+        return future
+
+    def _batcher(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.batch_wait
+
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get(
+                        timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+
+            # Whatever goes wrong, fail this batch and keep serving.
+            try:
+                self.score_batch(batch)
+            except Exception as error:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(RuntimeError(
+                            'Scoring failed: {}'.format(error)))
+
+    def score_batch(self, batch):
+        """
+        Score a batch of queued requests, building each board only once.
+        Requests on the same board and k are answered from a single fused
+        get_all_scores pass.
+
+        :param batch: list of (request, future) tuples.
+        :return:
+        """
+        boards = {}
+        answers = {}
+        passes = 0
+
+        groups = collections.defaultdict(list)
+        for request, future in batch:
+            groups[request[0], request[2]].append((request, future))
+
+        for (board_key, k), members in groups.items():
+            # Needs only change fill_rate, so requests without them can
+            # share the pass of the first request that has them.
+            shared = next((request[3] for request, _ in members if request[3]),
+                          ())
+            uses = collections.Counter(request[3] or shared
+                                       for request
+                                       in {request for request, _ in members})
+            all_scores = {}
+
+            for request, future in members:
+                _, metric, _, needs, weights, top = request
+                needs = needs or shared
+
+                try:
+                    if request not in answers:
+                        if board_key not in boards:
+                            tiles, ports, layout = json.loads(board_key)
+                            boards[board_key] = Board.from_description(
+                                tiles, ports, layout)
+                        board = boards[board_key]
+                        if needs not in all_scores and (uses[needs] > 1 or
+                                                        weights):
+                            all_scores[needs] = board.get_all_scores(
+                                k, dict(needs))
+                            passes += 1
+                        if weights:
+                            scores = board.get_composite_scores(
+                                dict(weights), k, dict(needs),
+                                all_scores.get(needs))
+                        else:
+                            scores = board.get_scores(
+                                metric, k, dict(needs), all_scores.get(needs))
+                        answers[request] = scores[:top] if top else scores
+                except (ValueError, KeyError, TypeError,
+                        IndexError) as error:
+                    future.set_exception(ValueError(str(error)))
+                    continue
+
+                future.set_result(answers[request])
+
+        with self._lock:
+            self.counters['batches'] += 1
+            self.counters['batched_requests'] += len(batch)
+            self.counters['boards_built'] += len(boards)
+            self.counters['fused_passes'] += passes
+
+            for request, scores in answers.items():
+                self._cache[request] = scores
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def record(self, latency, error=False):
+        with self._lock:
+            self._latencies.append(latency)
+            if error:
+                self.counters['errors'] += 1
+
+    def metrics(self):
+        """
+        Return the service counters, throughput and latency percentiles.
+
+        :return: dictionary
+        """
+        with self._lock:
+            metrics = dict(self.counters)
+            latencies = sorted(self._latencies)
+
+        uptime = time.monotonic() - self._started
+        metrics['uptime'] = uptime
+        metrics['requests_per_second'] = metrics['requests'] / uptime
+        metrics['mean_batch_size'] = (metrics['batched_requests'] /
+                                      (metrics['batches'] or 1))
+        metrics['cache_entries'] = len(self._cache)
+        for percentile in (50, 90, 99):
+            key = 'latency_p{}_ms'.format(percentile)
+            metrics[key] = (latencies[(len(latencies) - 1) * percentile // 100]
+                            * 1000
+                            if latencies else 0)
+
+        return metrics
+
+    def server(self, host='127.0.0.1', port=8000):
+        """
+        Return an HTTP server for the service, not yet serving.
+
+        :param host: address to bind.
+        :param port: port to bind, 0 for any free port.
+        :return:
+        """
+        server = http.server.ThreadingHTTPServer((host, port),
+                                                 ScoringRequestHandler,
+                                                 bind_and_activate=False)
+        server.daemon_threads = True
+        server.request_queue_size = 128
+        server.service = self
+
+        try:
+            server.server_bind()
+            server.server_activate()
+        except OSError:
+            server.server_close()
+            raise
+
+        return server
+
+    @staticmethod
+    def load(url, count=1000, concurrency=16, boards=50, metric='dot_sum',
+             mode='single'):
+        """
+        Send count requests to a running service and time them.
+
+        Boards are drawn from the first boards random seeds, so repeated
+        boards exercise the cache.
+
+        :param url: base URL of the service.
+        :param count: number of requests.
+        :param concurrency: number of requests in flight.
+        :param boards: number of distinct boards.
+        :param metric: metric requested.
+        :param mode: 'single' or 'pairwise'.
+        :return: dictionary of throughput and latency.
+        """
+        bodies = []
+        for seed in range(boards):
+            bodies.append(json.dumps({
+                'tiles': [(tile.resource, tile.number)
+                          for tile in Board.random_board(seed).tiles],
+                'metric': metric,
+                'mode': mode
+            }).encode())
+
+        def send(i):
+            started = time.monotonic()
+            request = urllib.request.Request(
+                url.rstrip('/') + '/score',
+                data=bodies[i % boards],
+                headers={'Content-Type': 'application/json'})
+            with urllib.request.urlopen(request) as response:
+                response.read()
+
+            return time.monotonic() - started
+
+        started = time.monotonic()
+        with concurrent.futures.ThreadPoolExecutor(concurrency) as executor:
+            latencies = sorted(executor.map(send, range(count)))
+        elapsed = time.monotonic() - started
+
+        return {
+            'requests': count,
+            'seconds': elapsed,
+            'requests_per_second': count / elapsed,
+            'latency_p50_ms': latencies[(count - 1) * 50 // 100] * 1000,
+            'latency_p99_ms': latencies[(count - 1) * 99 // 100] * 1000
+        }
+
+
+class ScoringRequestHandler(http.server.BaseHTTPRequestHandler):
+    """
+    HTTP front end of a ScoringService.
+    """
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            self.send_json(200, self.server.service.metrics())
+        else:
+            self.send_json(404, {'error': 'Not found.'})
+
+    def do_POST(self):
+        if self.path != '/score':
+            self.send_json(404, {'error': 'Not found.'})
+            return
+
+        started = time.monotonic()
+        service = self.server.service
+
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            data = json.loads(self.rfile.read(length))
+            scores = service.submit(data).result(timeout=service.timeout)
+        except ValueError as error:
+            service.record(time.monotonic() - started, error=True)
+            self.send_json(400, {'error': str(error)})
+            return
+        except concurrent.futures.TimeoutError:
+            service.record(time.monotonic() - started, error=True)
+            self.send_json(503, {'error': 'Timed out.'})
+            return
+        except RuntimeError as error:
+            service.record(time.monotonic() - started, error=True)
+            self.send_json(500, {'error': str(error)})
+            return
+
+        service.record(time.monotonic() - started)
+        self.send_json(200, {'scores': scores})
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
 class Application(tk.Frame):
 
     def __init__(self, master=None):
@@ -477,20 +2172,40 @@ class Application(tk.Frame):
         for need in self.needs:
             self.needs[need].set(10)
 
+        # Setup variables for weighted ranking, in percent.
+        self.weights = {
+            metric: tk.IntVar()
+            for metric
+            in Board.metrics
+        }
+
+        for weight in self.weights:
+            self.weights[weight].set(0)
+        self.weights['dot_sum'].set(100)
+
         # Setup the menu
         self.menu = tk.Menu(self)
         filemenu = tk.Menu(self.menu, tearoff=0)
         filemenu.add_command(label='Edit Board', command=self.setup_board)
+        filemenu.add_command(
+            label='New Base Board',
+            command=lambda: self.new_board(Layout.base()))
+        filemenu.add_command(
+            label='New 5-6 Player Board',
+            command=lambda: self.new_board(Layout.expansion()))
         filemenu.add_command(label='Set Resource Needs', command=self.set_needs)
+        filemenu.add_command(label='Set Metric Weights',
+                             command=self.set_weights)
         filemenu.add_separator()
-        filemenu.add_command(label='Exit', command=root.quit)
+        filemenu.add_command(label='Exit', command=self.master.quit)
         self.menu.add_cascade(label='Setup', menu=filemenu)
 
         # Get Board object to manipulate
         self.board = Board.random_board()
 
-        # Setup sizes for canvas.
-        self.canvas_size = 400
+        # Setup sizes for canvas, in pixels per layout unit.
+        self.unit_x = 40
+        self.unit_y = 25
         self.canvas_pad = 50
 
         # Setup Left & Right frames.
@@ -500,9 +2215,7 @@ class Application(tk.Frame):
         self.right.grid(column=1, row=0, sticky='NE')
 
         # Setup and draw canvas on the right.
-        self.canvas = tk.Canvas(self.right,
-                                width=self.canvas_size + (2 * self.canvas_pad),
-                                height=self.canvas_size + (2 * self.canvas_pad))
+        self.canvas = tk.Canvas(self.right)
         self.canvas.grid()
         self.draw_board()
 
@@ -511,18 +2224,19 @@ class Application(tk.Frame):
         self.metric_label.grid(row=0, sticky='EW')
 
         self.metric = tk.StringVar()
-        metric_options = [
-            'Dot Count',
-            'Hit Frequency',
-            'Resource Rate',
-            'Resource Rate with Trades',
-            'Resource Needs'
-        ]
+        self.metric_options = {
+            'Dot Count': 'dot_sum',
+            'Hit Frequency': 'hit_frequency',
+            'Resource Rate': 'flow_rate_no_trades',
+            'Resource Rate with Trades': 'flow_rate',
+            'Resource Needs': 'fill_rate',
+            'Weighted': 'composite'
+        }
         self.metric_box = ttk.Combobox(
             self.left,
-            values=metric_options,
+            values=list(self.metric_options),
             textvariable=self.metric,
-            width=max(len(x) for x in metric_options)
+            width=max(len(x) for x in self.metric_options)
             )
         self.metric_box.grid(row=1, columnspan=2, sticky='NEW')
 
@@ -550,6 +2264,10 @@ class Application(tk.Frame):
 
         self.list.list = None
 
+    def new_board(self, layout):
+        self.board = Board.random_board(layout=layout)
+        self.draw_board()
+
     def setup_board(self):
         window = tk.Toplevel(self)
 
@@ -558,14 +2276,14 @@ class Application(tk.Frame):
         res_values = [
             tk.StringVar()
             for i
-            in range(19)
+            in range(len(self.board.tiles))
         ]
         num_values = [
             tk.IntVar()
             for i
-            in range(19)
+            in range(len(self.board.tiles))
         ]
-        for i in range(19):
+        for i in range(len(self.board.tiles)):
             if self.board.tiles[i].resource:
                 res_values[i].set(self.board.tiles[i].resource)
             else:
@@ -579,7 +2297,7 @@ class Application(tk.Frame):
         ttk.Label(window, text='Resource').grid(column=1, row=0)
         ttk.Label(window, text='Number').grid(column=2, row=0)
 
-        for i in range(19):
+        for i in range(len(self.board.tiles)):
             ttk.Label(window, text=str(i)).grid(column=0, row=i+1, sticky='W')
             res = ttk.Combobox(
                 window,
@@ -595,22 +2313,19 @@ class Application(tk.Frame):
             num.grid(column=2, row=i+1, sticky='W')
 
         def create_board():
-            for i in range(19):
+            for i in range(len(self.board.tiles)):
                 if res_values[i].get() != 'desert':
-                    self.board.tiles[i].resource = res_values[i].get()
+                    self.board.set_tile(i,
+                                        res_values[i].get(),
+                                        num_values[i].get())
                 else:
-                    self.board.tiles[i].resource = None
-
-                if res_values[i].get() != 'desert':
-                    self.board.tiles[i].number = num_values[i].get()
-                else:
-                    self.board.tiles[i].number = None
+                    self.board.set_tile(i, None, None)
 
             self.draw_board()
 
             window.destroy()
 
-        ttk.Button(window, text='Create Board', command=create_board).grid(column=1, columnspan=2, row=21, sticky='W')
+        ttk.Button(window, text='Create Board', command=create_board).grid(column=1, columnspan=2, row=len(self.board.tiles) + 2, sticky='W')
 
     def set_needs(self):
         window = tk.Toplevel(self)
@@ -652,6 +2367,25 @@ class Application(tk.Frame):
 
         ttk.Button(window, text='Done', command=window.destroy).grid(column=1, row=6)
 
+    def set_weights(self):
+        window = tk.Toplevel(self)
+
+        ttk.Label(window, text='Metric').grid(column=0, row=0)
+        ttk.Label(window, text='Weight (%)').grid(column=1, row=0)
+
+        for i, (label, metric) in enumerate(self.metric_options.items()):
+            if metric not in self.weights:
+                continue
+
+            ttk.Label(window, text=label).grid(column=0, row=i+1, sticky='W')
+            tk.Scale(window,
+                     from_=0,
+                     to=100,
+                     orient=tk.HORIZONTAL,
+                     variable=self.weights[metric]).grid(column=1, row=i+1)
+
+        ttk.Button(window, text='Done', command=window.destroy).grid(column=1, row=len(self.metric_options) + 1)
+
     def select_optimum(self):
         self.list.length = 20
 
@@ -660,53 +2394,19 @@ class Application(tk.Frame):
         self.list.list = tk.Frame(self.list)
         self.list.list.grid(column=0, row=1, columnspan=2, sticky='NESW')
 
-        method = self.metric_box.get()
-
-        if method == 'Dot Count' and not self.pairwise.get():
-            scores = [(node.index, node.get_dot_sum())
-                      for node
-                      in self.board.nodes]
-            scores.sort(key=lambda x: x[1], reverse=True)
-        elif method == 'Hit Frequency' and not self.pairwise.get():
-            scores = [(node.index, node.get_hit_frequency())
-                      for node
-                      in self.board.nodes]
-            scores.sort(key=lambda x: x[1], reverse=True)
-        elif method == 'Resource Rate' and not self.pairwise.get():
-            scores = [(node.index, node.get_flow_rate_no_trades())
-                      for node
-                      in self.board.nodes]
-            scores.sort(key=lambda x: x[1], reverse=True)
-        elif method == 'Resource Rate with Trades' and not self.pairwise.get():
-            scores = [(node.index, sum(node.get_flow_rate().values()))
-                      for node
-                      in self.board.nodes]
-            scores.sort(key=lambda x: x[1], reverse=True)
-        elif method == 'Resource Needs' and not self.pairwise.get():
-            needs = {k: v.get() for k, v in self.needs.items()}
-            scores = [(node.index, node.get_fill_rate(needs))
-                      for node
-                      in self.board.nodes]
-            scores.sort(key=lambda x: x[1])
-        elif method == 'Dot Count' and self.pairwise.get():
-            scores = self.board.get_pairwise_dot_sum()
-            scores.sort(key=lambda x: x[1], reverse=True)
-        elif method == 'Hit Frequency' and self.pairwise.get():
-            scores = self.board.get_pairwise_hit_frequency()
-            scores.sort(key=lambda x: x[1], reverse=True)
-        elif method == 'Resource Rate' and self.pairwise.get():
-            scores = self.board.get_pairwise_flow_rate_no_trades()
-            scores.sort(key=lambda x: x[1], reverse=True)
-        elif method == 'Resource Rate with Trades' and self.pairwise.get():
-
-            scores = [(pair, sum(flow.values()))
-                      for pair, flow
-                      in self.board.get_pairwise_flow_rate()]
-            scores.sort(key=lambda x: x[1], reverse=True)
-        elif method == 'Resource Needs' and self.pairwise.get():
-            needs = {k: v.get() for k, v in self.needs.items()}
-            scores = self.board.get_pairwise_fill_rate(needs)
-            scores.sort(key=lambda x: x[1])
+        method = self.metric_options.get(self.metric_box.get())
+
+        needs = {k: v.get() for k, v in self.needs.items()}
+        k = 2 if self.pairwise.get() else 1
+
+        if method == 'composite':
+            weights = {metric: weight.get() / 100
+                       for metric, weight
+                       in self.weights.items()
+                       if weight.get()}
+            scores = self.board.get_composite_scores(weights, k, needs)
+        elif method:
+            scores = self.board.get_scores(method, k, needs)
         else:
             scores = []
 
@@ -724,14 +2424,16 @@ class Application(tk.Frame):
                                                                 padx=10)
 
     def draw_board(self):
-        # Clear canvas.
+        layout = self.board.layout
+        width = layout.width * self.unit_x + (2 * self.canvas_pad)
+        height = layout.height * self.unit_y + (2 * self.canvas_pad)
+
+        # Clear and size canvas.
         self.canvas.delete('all')
+        self.canvas.config(width=width, height=height)
 
         # Add background.
-        self.canvas.create_rectangle(0, 0,
-                                     self.canvas_size + (2 * self.canvas_pad),
-                                     self.canvas_size + (2 * self.canvas_pad),
-                                     fill='light blue')
+        self.canvas.create_rectangle(0, 0, width, height, fill='light blue')
 
         colors = {
             'lumber': 'dark green',
@@ -743,27 +2445,9 @@ class Application(tk.Frame):
             'all': 'white'
         }
         # Draw Tiles
-        hex_starts = [
-            (120, 0),
-            (200, 0),
-            (280, 0),
-            (80, 75),
-            (160, 75),
-            (240, 75),
-            (320, 75),
-            (40, 150),
-            (120, 150),
-            (200, 150),
-            (280, 150),
-            (360, 150),
-            (80, 225),
-            (160, 225),
-            (240, 225),
-            (320, 225),
-            (120, 300),
-            (200, 300),
-            (280, 300),
-        ]
+        hex_starts = [(x * self.unit_x, y * self.unit_y)
+                      for x, y
+                      in layout.tile_positions]
 
         # For every hex
         for i, (x, y) in enumerate(hex_starts):
@@ -784,48 +2468,33 @@ class Application(tk.Frame):
                     text=str(self.board.tiles[i].number)
                 )
 
-        # Draw ports to the board.
-        port_locs = [
-            (120, 30, 120, 0, 80, 25),
-            (270, 15, 200, 0, 240, 25),
-            (400, 90, 320, 75, 360, 100),
-            (470, 240, 400, 175, 400, 225),
-            (405, 385, 360, 300, 320, 325),
-            (275, 450, 240, 375, 200, 400),
-            (110, 450, 120, 400, 80, 375),
-            (30, 325, 40, 250, 40, 300),
-            (40, 150, 40, 100, 40, 150)
-        ]
+        node_coords = [(x * self.unit_x + self.canvas_pad,
+                        y * self.unit_y + self.canvas_pad)
+                       for x, y
+                       in layout.nodes]
 
-        for i, port in enumerate(self.board.ports):
+        # Draw ports to the board, pushed out from the middle of their tile.
+        for port in self.board.ports:
             port_size = 20
 
-            x, y, line_one_x, line_one_y, line_two_x, line_two_y = port_locs[i]
-
-            self.canvas.create_line(
-                x + (port_size / 2), y + (port_size / 2),
-                line_one_x + self.canvas_pad, line_one_y + self.canvas_pad
-            )
-            self.canvas.create_line(
-                x + (port_size / 2), y + (port_size / 2),
-                line_two_x + self.canvas_pad, line_two_y + self.canvas_pad
-            )
+            (ax, ay), (bx, by) = (node_coords[n] for n in port.nodes)
+            tile = next(t
+                        for t in layout.node_tiles[port.nodes[0]]
+                        if t in layout.node_tiles[port.nodes[1]])
+            center_x = hex_starts[tile][0] + self.canvas_pad
+            center_y = hex_starts[tile][1] + 50 + self.canvas_pad
+            x = (ax + bx) - center_x
+            y = (ay + by) - center_y
+
+            self.canvas.create_line(x, y, ax, ay)
+            self.canvas.create_line(x, y, bx, by)
             self.canvas.create_rectangle(
-                x, y,
-                x + 20, y + 20,
+                x - (port_size / 2), y - (port_size / 2),
+                x + (port_size / 2), y + (port_size / 2),
                 fill=colors[port.resource]
             )
 
         # Add node indexes to board.
-        node_coords = set()
-        for x, y in hex_starts:
-            for coord in self.get_hex_coords(x + self.canvas_pad,
-                                             y + self.canvas_pad):
-                node_coords.add(coord)
-        node_coords = list(node_coords)
-        node_coords.sort(key=lambda x: x[0])
-        node_coords.sort(key=lambda x: x[1])
-
         for i, (x, y) in enumerate(node_coords):
             self.canvas.create_oval(x - 10, y - 10,
                                     x + 10, y + 10,
@@ -843,9 +2512,233 @@ class Application(tk.Frame):
         ]
 
 
-if __name__ == '__main__':
+def main(argv=None):
+    """
+    Run the GUI, or a headless command when one is given.
+
+    :param argv: command line arguments, defaults to sys.argv.
+    :return: exit status.
+    """
+    parser = argparse.ArgumentParser(prog='CatanOptimum')
+    commands = parser.add_subparsers(dest='command')
+
+    score = commands.add_parser(
+        'score',
+        help='score board descriptions from JSONL or CSV, one line each')
+    score.add_argument('input', nargs='?', default='-',
+                       help='file to read, or - for stdin')
+    score.add_argument('--format', choices=['jsonl', 'csv'],
+                       help='input format, guessed from the file name')
+    score.add_argument('-m', '--metric', action='append',
+                       choices=Board.metrics, dest='metrics',
+                       help='metric to score, may be repeated')
+    score.add_argument('-k', type=int, default=1,
+                       help='number of settlements placed together')
+    score.add_argument('--needs', default='',
+                       help='resource needs, e.g. ore=4,grain=3')
+    score.add_argument('--top', type=int, default=10,
+                       help='number of scores written per metric, 0 for all')
+    score.add_argument('--weights', default='',
+                       help='metric weights of an added composite ranking, '
+                            'e.g. dot_sum=1,fill_rate=0.5')
+    score.add_argument('-j', '--workers', type=int, default=1,
+                       help='number of worker processes')
+
+    corpus = commands.add_parser(
+        'corpus',
+        help='analyze a range of random board seeds into a .npy file')
+    corpus.add_argument('output', help='.npy file to write')
+    corpus.add_argument('--start', type=int, default=0, help='first seed')
+    corpus.add_argument('--count', type=int, default=1000,
+                        help='number of seeds')
+    corpus.add_argument('--shard-size', type=int,
+                        help='number of seeds handed to a worker at once')
+    corpus.add_argument('--layout', choices=['base', 'expansion'],
+                        default='base', help='board layout')
+    corpus.add_argument('--seats', type=int, default=4,
+                        help='number of players in the seat spread draft')
+    corpus.add_argument('--bins', type=int, default=20,
+                        help='number of histogram bins in the summary')
+    corpus.add_argument('-j', '--workers', type=int, default=1,
+                        help='number of worker processes')
+
+    sweep = commands.add_parser(
+        'sweep',
+        help='resumable corpus analysis, checkpointed in a directory')
+    sweep.add_argument('directory', help='directory holding the sweep')
+    sweep.add_argument('--start', type=int, default=0, help='first seed')
+    sweep.add_argument('--count', type=int, default=1000,
+                       help='number of seeds')
+    sweep.add_argument('--shard-size', type=int, default=1000,
+                       help='number of seeds in a shard')
+    sweep.add_argument('--layout', choices=['base', 'expansion'],
+                       default='base', help='board layout')
+    sweep.add_argument('--seats', type=int, default=4,
+                       help='number of players in the seat spread draft')
+    sweep.add_argument('--bins', type=int, default=20,
+                       help='number of histogram bins in the summary')
+    sweep.add_argument('-j', '--workers', type=int, default=1,
+                       help='number of worker processes')
+
+    serve = commands.add_parser('serve', help='run the HTTP scoring service')
+    serve.add_argument('--host', default='127.0.0.1', help='address to bind')
+    serve.add_argument('--port', type=int, default=8000, help='port to bind')
+    serve.add_argument('--batch-size', type=int, default=32,
+                       help='most requests scored in one batch')
+    serve.add_argument('--batch-wait', type=float, default=0.002,
+                       help='seconds to wait for a batch to fill')
+    serve.add_argument('--cache-size', type=int, default=4096,
+                       help='number of answers kept in the cache')
+    serve.add_argument('--timeout', type=float, default=30,
+                       help='seconds a request waits for its answer')
+
+    load = commands.add_parser('load',
+                               help='load test a running scoring service')
+    load.add_argument('url', nargs='?', default='http://127.0.0.1:8000',
+                      help='base URL of the service')
+    load.add_argument('--requests', type=int, default=1000,
+                      help='number of requests')
+    load.add_argument('--concurrency', type=int, default=16,
+                      help='number of requests in flight')
+    load.add_argument('--boards', type=int, default=50,
+                      help='number of distinct boards')
+    load.add_argument('-m', '--metric', choices=Board.metrics,
+                      default='dot_sum', help='metric requested')
+    load.add_argument('--mode', choices=['single', 'pairwise'],
+                      default='single', help='placement mode requested')
+
+    balance = commands.add_parser(
+        'balance',
+        help='search for a balanced (or skewed) board by simulated annealing')
+    balance.add_argument('--seed', default='PyTN2018',
+                         help='seed of the starting random board and moves')
+    balance.add_argument('--layout', choices=['base', 'expansion'],
+                         default='base', help='board layout')
+    balance.add_argument('-m', '--metric', choices=Board.metrics,
+                         default='dot_sum', help='metric nodes are ranked by')
+    balance.add_argument('--rank', type=int, default=8,
+                         help='rank of the node compared against the best')
+    balance.add_argument('--skew', action='store_true',
+                         help='maximize the gap instead of minimizing it')
+    balance.add_argument('--needs', default='',
+                         help='resource needs for fill_rate, '
+                              'e.g. ore=4,grain=3')
+    balance.add_argument('--moves', type=int, default=20000,
+                         help='number of swap moves to try')
+
+    args = parser.parse_args(argv)
+
+    if args.command in ('score', 'balance'):
+        needs = {resource: 10 for resource in Tile.resources}
+        for item in filter(None, args.needs.split(',')):
+            try:
+                resource, amount = item.split('=')
+                needs[resource] = int(amount)
+            except ValueError:
+                parser.error('Bad --needs item {!r}.'.format(item))
+            if resource not in Tile.resources:
+                parser.error('Unknown resource {!r}.'.format(resource))
+
+    if args.command == 'score':
+        weights = {}
+        for item in filter(None, args.weights.split(',')):
+            try:
+                metric, weight = item.split('=')
+                weights[metric] = float(weight)
+            except ValueError:
+                parser.error('Bad --weights item {!r}.'.format(item))
+
+        fmt = args.format or ('csv' if args.input.endswith('.csv')
+                              else 'jsonl')
+        try:
+            scorer = BatchScorer(args.metrics or ['dot_sum'], args.k, needs,
+                                 args.top, args.workers, weights=weights)
+        except ValueError as error:
+            parser.error(str(error))
+
+        stream = (sys.stdin if args.input == '-'
+                  else open(args.input, newline=''))
+        with stream:
+            try:
+                for line in scorer.run(BatchScorer.read(stream, fmt)):
+                    sys.stdout.write(line + '\n')
+                sys.stdout.flush()
+            except BrokenPipeError:
+                # The reader has gone, e.g. piped into head. Point stdout
+                # at devnull so the flush at exit does not fail again.
+                os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+
+        return 0
+
+    if args.command in ('corpus', 'sweep'):
+        if args.command == 'corpus':
+            if args.shard_size is not None and args.shard_size < 1:
+                parser.error('--shard-size must be at least 1.')
+            try:
+                corpus = Corpus.build(args.output, args.start, args.count,
+                                      args.workers, args.layout, args.seats,
+                                      args.shard_size)
+            except ValueError as error:
+                parser.error(str(error))
+        else:
+            try:
+                sweep = Sweep(args.directory, args.start, args.count,
+                              args.shard_size, args.layout, args.seats)
+                sweep.run(args.workers)
+                corpus = sweep.merge()
+            except ValueError as error:
+                parser.error(str(error))
+
+        # Summary histograms are written next to the dataset.
+        with open(corpus.path + '.json', 'w') as f:
+            json.dump(corpus.summary(args.bins), f, indent=2)
+        corpus.close()
+
+        return 0
+
+    if args.command == 'balance':
+        board = Board.random_board(args.seed, Layout.named(args.layout))
+        try:
+            annealer = BoardAnnealer(board, args.metric, args.rank,
+                                     args.skew, needs, args.seed)
+        except ValueError as error:
+            parser.error(str(error))
+        start_gap = annealer.get_gap()
+        stats = annealer.run(args.moves)
+        stats['start_gap'] = start_gap
+        stats['tiles'] = [(tile.resource, tile.number)
+                          for tile in board.tiles]
+        print(json.dumps(stats))
+
+        return 0
+
+    if args.command == 'serve':
+        service = ScoringService(args.batch_size, args.batch_wait,
+                                 args.cache_size, args.timeout)
+        with service.server(args.host, args.port) as server:
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+
+        return 0
+
+    if args.command == 'load':
+        print(json.dumps(ScoringService.load(args.url, args.requests,
+                                             args.concurrency, args.boards,
+                                             args.metric, args.mode),
+                         indent=2))
+
+        return 0
+
     root = tk.Tk()
     root.title('Settlers of Catan: Optimum Intersection')
     app = Application(master=root)
     root.config(menu=app.menu)
     app.mainloop()
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())